@@ -2,12 +2,37 @@
 Session management for Avigilon authentication.
 Handles saving/loading browser cookies for persistent sessions.
 """
-import json
 import os
+import re
 from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+    import json
+
+from playwright.async_api import BrowserContext as AsyncBrowserContext
 from playwright.sync_api import sync_playwright, Browser, BrowserContext
 from config import config
 
+# Matches the host/path of the Avigilon login page (session expired / not authenticated)
+_LOGIN_URL_RE = re.compile(r"login|signin", re.IGNORECASE)
+
+
+def is_login_url(url: str) -> bool:
+    """Check if URL is a login page, i.e. we were redirected due to no session."""
+    # Only the host and path matter; skip the (potentially long) query and SPA fragment
+    parts = urlsplit(url)
+    return _LOGIN_URL_RE.search(parts.netloc) is not None or _LOGIN_URL_RE.search(parts.path) is not None
+
+
+def _css_string(value: str) -> str:
+    """Escape a value for use inside a double-quoted CSS attribute selector."""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
 
 class SessionManager:
     """Manages persistent browser sessions with Avigilon."""
@@ -20,28 +45,43 @@ class SessionManager:
         return self.cookies_file.exists()
 
     def save_cookies(self, context: BrowserContext):
-        """Save browser cookies to file."""
-        cookies = context.cookies()
-        with open(self.cookies_file, "w") as f:
-            json.dump(cookies, f, indent=2)
+        """Save browser session (cookies and localStorage) to file."""
+        # Playwright's storage state format can be passed straight to new_context()
+        self.write_storage_state(context.storage_state())
+        print(f"Cookies saved to {self.cookies_file}")
+
+    def write_storage_state(self, state: dict):
+        """Write a Playwright storage state dict to the cookies file."""
+        if orjson:
+            self.cookies_file.write_bytes(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+        else:
+            with open(self.cookies_file, "w") as f:
+                json.dump(state, f, indent=2)
         # Set restrictive file permissions (owner read/write only)
         os.chmod(self.cookies_file, 0o600)
-        print(f"Cookies saved to {self.cookies_file}")
 
-    def load_cookies(self, context: BrowserContext):
-        """Load browser cookies from file."""
+    def load_storage_state(self) -> Optional[dict]:
+        """
+        Load saved session for use as new_context(storage_state=...).
+        Returns None if the file is missing or unreadable.
+        """
         if not self.cookies_exist():
-            return False
+            return None
 
         try:
-            with open(self.cookies_file, "r") as f:
-                cookies = json.load(f)
-            context.add_cookies(cookies)
-            print(f"Cookies loaded from {self.cookies_file}")
-            return True
+            if orjson:
+                state = orjson.loads(self.cookies_file.read_bytes())
+            else:
+                with open(self.cookies_file, "r") as f:
+                    state = json.load(f)
         except Exception as e:
             print(f"Failed to load cookies: {e}")
-            return False
+            return None
+
+        # Older versions saved a bare list of cookies
+        if isinstance(state, list):
+            state = {"cookies": state, "origins": []}
+        return state
 
     def clear_cookies(self):
         """Delete saved cookies file."""
@@ -49,24 +89,24 @@ class SessionManager:
             self.cookies_file.unlink()
             print("Cookies cleared")
 
-    def is_session_valid(self, context: BrowserContext) -> bool:
+    async def is_session_valid(self, context: AsyncBrowserContext) -> bool:
         """
         Check if current session is valid by navigating to Avigilon URL.
         Returns True if we can access the page, False if redirected to login.
         """
         try:
-            page = context.new_page()
-            page.goto(config.avigilon_url, timeout=10000)
+            page = await context.new_page()
+            await page.goto(config.avigilon_url, timeout=10000)
 
             # Check if we're on the login page or have access
             # This is a heuristic - adjust based on actual Avigilon behavior
             current_url = page.url
-            title = page.title()
+            title = await page.title()
 
-            page.close()
+            await page.close()
 
             # If we're redirected to login page, session is invalid
-            if "login" in current_url.lower() or "signin" in current_url.lower():
+            if is_login_url(current_url):
                 return False
 
             # If page loaded successfully with expected content, session is valid
@@ -110,6 +150,18 @@ def manual_authenticate():
             button = page.get_by_text(config.door_button_text, exact=False)
             if button.count() > 0:
                 print(f"✓ Found '{config.door_button_text}' button")
+                # Suggest a stable selector so door.py can skip the text scan
+                element_id, test_id = button.first.evaluate(
+                    "el => [el.id, el.getAttribute('data-testid')]"
+                )
+                if element_id:
+                    selector = f'[id="{_css_string(element_id)}"]'
+                elif test_id:
+                    selector = f'[data-testid="{_css_string(test_id)}"]'
+                else:
+                    selector = None
+                if selector and not config.door_button_selector:
+                    print(f"  Tip: add DOOR_BUTTON_SELECTOR={selector} to .env for faster lookups")
             else:
                 print(f"⚠ Warning: Could not find '{config.door_button_text}' button")
                 response = input("Save session anyway? (y/n): ")
@@ -3,12 +3,16 @@ Configuration management for Pi Home Server.
 Loads and validates environment variables.
 """
 import os
+import re
 from typing import List
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# E.164 phone number format: leading + followed by digits
+_E164 = re.compile(r"^\+\d+$")
+
 
 class Config:
     """Application configuration loaded from environment variables."""
@@ -20,11 +24,16 @@ class Config:
 
         # Security - allowed phone numbers
         allowed_numbers_str = self._get_required("ALLOWED_PHONE_NUMBERS")
-        self.allowed_phone_numbers = self._parse_phone_numbers(allowed_numbers_str)
+        # Stored as a frozenset for O(1) lookups on every incoming SMS
+        self.allowed_phone_numbers = frozenset(self._parse_phone_numbers(allowed_numbers_str))
 
         # Avigilon configuration
         self.avigilon_url = self._get_required("AVIGILON_URL")
         self.door_button_text = self._get_required("DOOR_BUTTON_TEXT")
+        # Optional CSS selector for the door button (printed by auth.py)
+        self.door_button_selector = os.getenv("DOOR_BUTTON_SELECTOR") or None
+        # Optional URL fragment of the request fired when the door unlocks
+        self.unlock_api_path = os.getenv("UNLOCK_API_PATH") or None
 
         # Server configuration
         self.host = os.getenv("HOST", "0.0.0.0")
@@ -37,6 +46,12 @@ class Config:
         self.rate_limit_max_requests = 10  # per hour
         self.rate_limit_window_seconds = 3600  # 1 hour
 
+        # How long a session validity check result is reused
+        self.session_check_cache_seconds = 30
+
+        # How often the browser revisits Avigilon to keep the session warm
+        self.keep_alive_interval_seconds = 300  # 5 minutes
+
     @staticmethod
     def _get_required(key: str) -> str:
         """Get required environment variable or raise error."""
@@ -50,12 +65,10 @@ class Config:
         """Parse comma-separated phone numbers into list."""
         numbers = [num.strip() for num in numbers_str.split(",")]
 
-        # Validate E.164 format (basic check)
-        for num in numbers:
-            if not num.startswith("+"):
-                raise ValueError(f"Phone number {num} must be in E.164 format (+1234567890)")
-            if not num[1:].isdigit():
-                raise ValueError(f"Phone number {num} contains invalid characters")
+        # Validate E.164 format (basic check), reporting all bad numbers at once
+        invalid = [num for num in numbers if not _E164.match(num)]
+        if invalid:
+            raise ValueError(f"Phone numbers {invalid} must be in E.164 format (+1234567890)")
 
         return numbers
 
@@ -2,58 +2,146 @@
 Door automation using Playwright.
 Handles browser interaction with Avigilon to open doors.
 """
+import asyncio
 import logging
+import re
+import time
 from typing import Optional
-from playwright.sync_api import sync_playwright, Browser, BrowserContext, Page, TimeoutError
-from auth import SessionManager
+from playwright.async_api import async_playwright, Playwright, Browser, BrowserContext, Error, Locator, Page, TimeoutError
+from auth import SessionManager, is_login_url
 from config import config
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Case-insensitive match on the door button's accessible name
+_DOOR_BUTTON_NAME = re.compile(re.escape(config.door_button_text), re.IGNORECASE)
+
 
 class DoorOpener:
     """Handles door opening automation via browser."""
 
     def __init__(self):
         self.session_manager = SessionManager()
+        self._playwright: Optional[Playwright] = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
-
-    def start(self):
+        self.page: Optional[Page] = None
+        # (time.monotonic() of check, result) of the last session validity check
+        self._session_valid_cached: Optional[tuple[float, bool]] = None
+        # Serializes door actions, since they all drive the shared page
+        self._lock = asyncio.Lock()
+        # Storage state last read from or written to the cookies file
+        self._saved_state: Optional[dict] = None
+
+    async def start(self):
         """Initialize browser and load session."""
         if self.browser:
             logger.warning("Browser already started")
             return
 
         logger.info("Starting browser...")
-        playwright = sync_playwright().start()
-        self.browser = playwright.chromium.launch(headless=True)
-        self.context = self.browser.new_context()
+        self._playwright = await async_playwright().start()
+        self.browser = await self._playwright.chromium.launch(headless=True)
 
-        # Load saved cookies if they exist
-        if self.session_manager.cookies_exist():
-            self.session_manager.load_cookies(self.context)
+        # Create the context from the saved session if it exists
+        storage_state = self.session_manager.load_storage_state()
+        try:
+            self.context = await self.browser.new_context(storage_state=storage_state)
+        except Exception as e:
+            logger.warning(f"Failed to load saved session, starting without one: {e}")
+            storage_state = None
+            self.context = await self.browser.new_context()
+        self._saved_state = storage_state
+        if storage_state is not None:
             logger.info("Session loaded from cookies")
         else:
             logger.warning("No saved session found")
 
-    def stop(self):
+        # Keep a single long-lived page rather than opening one per request
+        self.page = await self.context.new_page()
+
+    async def stop(self):
         """Close browser."""
         if self.browser:
-            self.browser.close()
+            if self.page and not self.page.is_closed():
+                await self.page.close()
+            await self.browser.close()
             self.browser = None
             self.context = None
+            self.page = None
             logger.info("Browser closed")
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
 
-    def check_session(self) -> bool:
-        """Check if current session is valid."""
+    async def check_session(self) -> bool:
+        """Check if current session is valid, reusing a recent result if available."""
         if not self.context:
             return False
-        return self.session_manager.is_session_valid(self.context)
 
-    def open_door(self) -> tuple[bool, str]:
+        now = time.monotonic()
+        if self._session_valid_cached:
+            checked_at, valid = self._session_valid_cached
+            if now - checked_at < config.session_check_cache_seconds:
+                return valid
+
+        valid = await self.session_manager.is_session_valid(self.context)
+        self._session_valid_cached = (now, valid)
+        return valid
+
+    async def _get_page(self) -> Page:
+        """Return the shared page, reopening it if it has been closed."""
+        if self.page is None or self.page.is_closed():
+            logger.info("Opening new browser page")
+            self.page = await self.context.new_page()
+        return self.page
+
+    @staticmethod
+    async def _wait_for_any(candidates: list[tuple[str, Locator]]):
+        """Wait until any of the candidate locators has a visible match."""
+        any_match = candidates[0][1]
+        for _, locator in candidates[1:]:
+            any_match = any_match.or_(locator)
+        await any_match.first.wait_for(state="visible", timeout=10000)
+
+    async def _find_door_button(self, page: Page) -> Optional[Locator]:
+        """
+        Wait for the door button to appear, then pick it by the most specific
+        locator that matches: configured CSS selector, button role by name,
+        and only then a text scan.
+        """
+        candidates = []
+        if config.door_button_selector:
+            candidates.append(("selector", page.locator(config.door_button_selector)))
+        candidates.append(("role", page.get_by_role("button", name=_DOOR_BUTTON_NAME)))
+        candidates.append(("text", page.get_by_text(config.door_button_text, exact=False)))
+
+        # Single wait for whichever locator matches first
+        try:
+            await self._wait_for_any(candidates)
+        except TimeoutError:
+            return None
+        except Error as e:
+            # e.g. an invalid DOOR_BUTTON_SELECTOR; wait again without it
+            logger.warning(f"Door button selector failed, ignoring it: {e}")
+            candidates = [c for c in candidates if c[0] != "selector"]
+            try:
+                await self._wait_for_any(candidates)
+            except TimeoutError:
+                return None
+
+        for kind, locator in candidates:
+            try:
+                if await locator.count() > 0:
+                    logger.info(f"Door button found by {kind}")
+                    return locator.first
+            except Error as e:
+                logger.warning(f"Door button lookup by {kind} failed: {e}")
+        return None
+
+    async def open_door(self) -> tuple[bool, str]:
         """
         Open the door by clicking the button.
 
@@ -63,44 +151,71 @@ class DoorOpener:
         if not self.browser or not self.context:
             return False, "Browser not initialized"
 
-        page: Optional[Page] = None
+        async with self._lock:
+            return await self._open_door()
+
+    async def _open_door(self) -> tuple[bool, str]:
+        """Drive the shared page to click the door button. Caller holds the lock."""
         try:
-            # Create new page
-            page = self.context.new_page()
+            # Reuse the shared page
+            page = await self._get_page()
             logger.info(f"Navigating to {config.avigilon_url}")
 
             # Navigate to door unlock page
-            page.goto(config.avigilon_url, timeout=15000)
+            await page.goto(config.avigilon_url, timeout=15000)
 
             # Check if we got redirected to login (session expired)
             current_url = page.url
-            if "login" in current_url.lower() or "signin" in current_url.lower():
+            if is_login_url(current_url):
                 logger.error("Session expired - redirected to login")
+                self._session_valid_cached = (time.monotonic(), False)
                 return False, "session_expired"
 
-            # Wait for page to be fully loaded
-            page.wait_for_load_state("networkidle", timeout=10000)
-
-            # Find and click the door button (case-insensitive text match)
+            # Find and click the door button
             logger.info(f"Looking for button with text: {config.door_button_text}")
-            button = page.get_by_text(config.door_button_text, exact=False)
+            button = await self._find_door_button(page)
 
             # Check if button exists
-            if button.count() == 0:
+            if button is None:
                 logger.error(f"Button '{config.door_button_text}' not found on page")
                 return False, "button_not_found"
 
             # Click the button
             logger.info("Clicking door button...")
-            button.first.click()
-
-            # Wait a moment for the action to complete
-            page.wait_for_timeout(2000)
+            if config.unlock_api_path:
+                # Wait for the unlock request to complete rather than a fixed delay
+                clicked = False
+                try:
+                    async with page.expect_response(
+                        lambda response: config.unlock_api_path in response.url, timeout=5000
+                    ) as response_info:
+                        await button.click()
+                        clicked = True
+                    response = await response_info.value
+                except TimeoutError:
+                    if not clicked:
+                        raise
+                    # The click went through, so the door may well have opened
+                    logger.warning("Door button clicked but no unlock response received")
+                    self._session_valid_cached = (time.monotonic(), True)
+                    return True, "unlock_unconfirmed"
+                if response.status in (401, 403):
+                    logger.error(f"Unlock request rejected ({response.status}) - session expired")
+                    self._session_valid_cached = (time.monotonic(), False)
+                    return False, "session_expired"
+                if not response.ok:
+                    logger.error(f"Unlock request failed with status {response.status}")
+                    return False, f"unlock_failed: HTTP {response.status}"
+            else:
+                await button.click()
+                # Wait a moment for the action to complete
+                await page.wait_for_timeout(2000)
 
             # Check for success indicators (adjust based on actual Avigilon behavior)
             # This might be a success message, button state change, etc.
             # For now, assume success if no error was thrown
             logger.info("Door button clicked successfully")
+            self._session_valid_cached = (time.monotonic(), True)
             return True, "success"
 
         except TimeoutError as e:
@@ -109,44 +224,87 @@ class DoorOpener:
         except Exception as e:
             logger.error(f"Unexpected error opening door: {e}")
             return False, f"error: {str(e)}"
-        finally:
-            if page:
-                page.close()
+
+    async def refresh_session(self) -> bool:
+        """
+        Revisit Avigilon to keep the session alive and save refreshed cookies.
+
+        Returns:
+            bool: True if the session is still valid
+        """
+        if not self.browser or not self.context:
+            return False
+
+        async with self._lock:
+            page = await self._get_page()
+            await page.goto(config.avigilon_url, timeout=15000)
+            valid = not is_login_url(page.url)
+            self._session_valid_cached = (time.monotonic(), valid)
+
+            # Only persist cookies from a live session, never a logged-out one
+            if valid:
+                state = await self.context.storage_state()
+                # Skip the write (and SD card wear) when nothing has changed
+                if state != self._saved_state:
+                    self.session_manager.write_storage_state(state)
+                    self._saved_state = state
+                    logger.info(f"Refreshed session saved to {self.session_manager.cookies_file}")
+            return valid
 
 
 # Global door opener instance
 _door_opener: Optional[DoorOpener] = None
 
 
-def get_door_opener() -> DoorOpener:
+async def get_door_opener() -> DoorOpener:
     """Get or create global door opener instance."""
     global _door_opener
     if _door_opener is None:
         _door_opener = DoorOpener()
-        _door_opener.start()
+        await _door_opener.start()
     return _door_opener
 
 
-def open_door() -> tuple[bool, str]:
+async def close_door_opener():
+    """Stop the global door opener instance, if one was started."""
+    global _door_opener
+    if _door_opener is not None:
+        await _door_opener.stop()
+        _door_opener = None
+
+
+async def keep_session_alive():
+    """Periodically refresh the Avigilon session until cancelled."""
+    while True:
+        await asyncio.sleep(config.keep_alive_interval_seconds)
+        try:
+            opener = await get_door_opener()
+            if not await opener.refresh_session():
+                logger.warning("Keep-alive: session expired")
+        except Exception as e:
+            logger.error(f"Keep-alive failed: {e}")
+
+
+async def open_door() -> tuple[bool, str]:
     """
     Convenience function to open the door.
 
     Returns:
         tuple: (success: bool, message: str)
     """
-    opener = get_door_opener()
-    return opener.open_door()
+    opener = await get_door_opener()
+    return await opener.open_door()
 
 
-def check_status() -> dict:
+async def check_status() -> dict:
     """
     Check system status.
 
     Returns:
         dict: Status information
     """
-    opener = get_door_opener()
-    session_valid = opener.check_session()
+    opener = await get_door_opener()
+    session_valid = await opener.check_session()
 
     return {
         "browser_running": opener.browser is not None,
@@ -155,29 +313,37 @@ def check_status() -> dict:
     }
 
 
-if __name__ == "__main__":
-    # Test door opening when run directly
+async def _main() -> int:
+    """Check status and attempt to open the door once."""
     print("Testing door opener...")
     print("=" * 60)
 
-    status = check_status()
-    print(f"Status: {status}")
-    print()
+    try:
+        status = await check_status()
+        print(f"Status: {status}")
+        print()
+
+        if not status["cookies_exist"]:
+            print("No session found. Run 'python auth.py' first to authenticate.")
+            return 1
 
-    if not status["cookies_exist"]:
-        print("No session found. Run 'python auth.py' first to authenticate.")
-        exit(1)
+        if not status["session_valid"]:
+            print("Session is invalid. Run 'python auth.py' to re-authenticate.")
+            return 1
 
-    if not status["session_valid"]:
-        print("Session is invalid. Run 'python auth.py' to re-authenticate.")
-        exit(1)
+        print("Attempting to open door...")
+        success, message = await open_door()
+
+        if success:
+            print(f"✓ Success: {message}")
+            return 0
+        else:
+            print(f"✗ Failed: {message}")
+            return 1
+    finally:
+        await close_door_opener()
 
-    print("Attempting to open door...")
-    success, message = open_door()
 
-    if success:
-        print(f"✓ Success: {message}")
-        exit(0)
-    else:
-        print(f"✗ Failed: {message}")
-        exit(1)
+if __name__ == "__main__":
+    # Test door opening when run directly
+    exit(asyncio.run(_main()))
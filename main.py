@@ -3,59 +3,100 @@ FastAPI server for SMS-controlled door opener.
 Receives Twilio webhooks and triggers door automation.
 """
 import asyncio
+import atexit
 import logging
-from datetime import datetime, timedelta
+import logging.handlers
+import queue
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
 from typing import Dict
-from fastapi import FastAPI, Form, Request, Response, HTTPException
+from fastapi import Depends, FastAPI, Form, Request, Response, HTTPException
 from fastapi.responses import PlainTextResponse
 from twilio.request_validator import RequestValidator
 from twilio.twiml.messaging_response import MessagingResponse
 from config import config
-from door import open_door, check_status
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from door import open_door, check_status, get_door_opener, close_door_opener, keep_session_alive
+
+# Set up logging. Handlers only enqueue records; a background listener thread
+# does the actual write so slow stdout/journal I/O stays off the request path.
+log_queue: queue.Queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+# Pass the bare message through; log_handler applies the real format
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
+log_listener.start()
+# Stop (and flush) the listener at interpreter exit, not app shutdown, so logs
+# emitted after the lifespan ends are still written
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the browser on startup and close it on shutdown."""
+    logger.info("Starting Pi Home Server...")
+    logger.info(f"Allowed phone numbers: {len(config.allowed_phone_numbers)}")
+    logger.info(f"Rate limit: {config.rate_limit_max_requests} requests per hour")
+
+    # Boot the browser now so the first SMS doesn't pay the launch cost
+    await get_door_opener()
+    keep_alive_task = asyncio.create_task(keep_session_alive())
+
+    yield
+
+    logger.info("Shutting down Pi Home Server...")
+    keep_alive_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await keep_alive_task
+    await close_door_opener()
+
+
 # Initialize FastAPI app
-app = FastAPI(title="Pi Home Server", version="1.0.0")
+app = FastAPI(title="Pi Home Server", version="1.0.0", lifespan=lifespan)
+
+# Twilio signature validator, created once and shared across requests
+twilio_validator = RequestValidator(config.twilio_auth_token)
 
 # Rate limiting (in-memory, per phone number)
-rate_limit_data: Dict[str, list] = {}
+# Maps phone number -> deque of request timestamps (time.monotonic), oldest first.
+# Only allowlisted numbers reach the rate limiter, so this stays bounded.
+rate_limit_data: Dict[str, deque] = defaultdict(deque)
 
 
 def check_rate_limit(phone_number: str) -> bool:
     """
     Check if phone number has exceeded rate limit.
 
+    This never awaits, so it runs atomically on the event loop and concurrent
+    webhooks cannot interleave their updates, even without a lock.
+
     Returns:
         bool: True if within limit, False if exceeded
     """
-    now = datetime.now()
-    cutoff = now - timedelta(seconds=config.rate_limit_window_seconds)
+    now = time.monotonic()
+    cutoff = now - config.rate_limit_window_seconds
 
-    # Get or initialize request history for this number
-    if phone_number not in rate_limit_data:
-        rate_limit_data[phone_number] = []
+    history = rate_limit_data[phone_number]
 
     # Remove old requests outside the time window
-    rate_limit_data[phone_number] = [
-        ts for ts in rate_limit_data[phone_number] if ts > cutoff
-    ]
+    while history and history[0] <= cutoff:
+        history.popleft()
 
     # Check if limit exceeded
-    if len(rate_limit_data[phone_number]) >= config.rate_limit_max_requests:
+    if len(history) >= config.rate_limit_max_requests:
         return False
 
     # Add current request
-    rate_limit_data[phone_number].append(now)
+    history.append(now)
     return True
 
 
-def validate_twilio_request(request: Request) -> bool:
+async def validate_twilio_request(request: Request) -> bool:
     """
     Validate that request came from Twilio using signature verification.
 
@@ -63,37 +104,33 @@ def validate_twilio_request(request: Request) -> bool:
         bool: True if valid, False otherwise
     """
     try:
-        validator = RequestValidator(config.twilio_auth_token)
-
         # Get Twilio signature from headers
         signature = request.headers.get("X-Twilio-Signature", "")
-
-        # Get full URL
-        url = str(request.url)
-
-        # Get form data (Twilio sends as form-encoded)
-        # Note: This is a simplified version. In production, you'd need to
-        # collect the form data properly
-        form_data = {}
-        # FastAPI doesn't make this easy - in practice, you might need to
-        # reconstruct the form data or use a different validation approach
-
-        # For now, we'll do a simpler check
         if not signature:
             logger.warning("No Twilio signature found in request")
             return False
 
-        # In production, uncomment and fix:
-        # return validator.validate(url, form_data, signature)
+        # Twilio signs the full URL plus all form-encoded POST parameters.
+        # The form has already been parsed for the endpoint's Form fields, and
+        # Starlette caches it on the request, so this does not re-read the body.
+        form_data = dict(await request.form())
 
-        # For now, just check that signature exists (basic security)
-        return True
+        return twilio_validator.validate(str(request.url), form_data, signature)
 
     except Exception as e:
         logger.error(f"Error validating Twilio request: {e}")
         return False
 
 
+async def require_twilio_signature(request: Request):
+    """Dependency that rejects requests without a valid Twilio signature."""
+    if not await validate_twilio_request(request):
+        logger.warning(f"Invalid Twilio signature for {request.url.path}")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+
+# Replies come from a small fixed set, so the rendered XML is cached
+@lru_cache(maxsize=32)
 def create_sms_response(message: str) -> str:
     """
     Create TwiML response for SMS.
@@ -109,20 +146,63 @@ def create_sms_response(message: str) -> str:
     return str(resp)
 
 
+async def handle_door(phone_number: str) -> str:
+    """Open the door and return the SMS reply."""
+    success, result = await open_door()
+
+    if success and result == "unlock_unconfirmed":
+        logger.warning(f"? Door button clicked for {phone_number} but unlock not confirmed")
+        return "Door button pressed, unlock not confirmed"
+    elif success:
+        now = time.localtime()
+        timestamp = f"{now.tm_hour % 12 or 12}:{now.tm_min:02d}{'AM' if now.tm_hour < 12 else 'PM'}"
+        logger.info(f"✓ Door opened successfully for {phone_number} at {timestamp}")
+        return "Opening door"
+    elif result == "session_expired":
+        logger.error("✗ Session expired - door NOT opened")
+        return "Session expired. Please re-authenticate."
+    else:
+        logger.error(f"✗ Failed to open door: {result}")
+        return "Failed to open door"
+
+
+async def handle_status(phone_number: str) -> str:
+    """Check server and session status and return the SMS reply."""
+    status = await check_status()
+
+    if status["session_valid"]:
+        message = "Server online. Session active."
+    elif status["cookies_exist"]:
+        message = "Server online. Session may be expired."
+    else:
+        message = "Server online. No session found."
+
+    logger.info(f"Status: {message}")
+    return message
+
+
+# SMS command -> handler returning the reply message
+COMMANDS = {
+    "door": handle_door,
+    "status": handle_status,
+}
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
     return {"status": "online", "service": "pi-home-server"}
 
 
-@app.post("/sms")
+@app.post("/sms", dependencies=[Depends(require_twilio_signature)])
 async def receive_sms(
-    request: Request,
     From: str = Form(...),
     Body: str = Form(...),
 ):
     """
     Twilio webhook endpoint for incoming SMS messages.
+    Requests without a valid Twilio signature are rejected with 403 before
+    this runs.
 
     Args:
         From: Sender's phone number
@@ -133,11 +213,6 @@ async def receive_sms(
     """
     logger.info(f"Received SMS from {From}: {Body}")
 
-    # Validate Twilio request
-    if not validate_twilio_request(request):
-        logger.warning(f"Invalid Twilio signature from {From}")
-        raise HTTPException(status_code=403, detail="Invalid signature")
-
     # Check if phone number is allowed
     if not config.is_phone_allowed(From):
         logger.warning(f"Unauthorized phone number: {From}")
@@ -153,66 +228,26 @@ async def receive_sms(
     # Parse command (case-insensitive)
     command = Body.strip().lower()
 
-    # Handle commands
-    if command == "door":
-        logger.info(f"Processing 'door' command from {From}")
-
-        success, result = await asyncio.to_thread(open_door)
-
-        if success:
-            timestamp = datetime.now().strftime("%I:%M%p").lstrip("0")
-            logger.info(f"✓ Door opened successfully for {From} at {timestamp}")
-            message = "Opening door"
-        elif result == "session_expired":
-            logger.error("✗ Session expired - door NOT opened")
-            message = "Session expired. Please re-authenticate."
-        else:
-            logger.error(f"✗ Failed to open door: {result}")
-            message = "Failed to open door"
-
-        return PlainTextResponse(content=create_sms_response(message), status_code=200, media_type="application/xml")
-
-    elif command == "status":
-        logger.info(f"Processing 'status' command from {From}")
-
-        status = await asyncio.to_thread(check_status)
-
-        if status["session_valid"]:
-            logger.info("Status: Server online. Session active.")
-            message = "Server online. Session active."
-        elif status["cookies_exist"]:
-            logger.info("Status: Server online. Session may be expired.")
-            message = "Server online. Session may be expired."
-        else:
-            logger.info("Status: Server online. No session found.")
-            message = "Server online. No session found."
-
-        return PlainTextResponse(content=create_sms_response(message), status_code=200, media_type="application/xml")
-
-    else:
+    handler = COMMANDS.get(command)
+    if handler is None:
         logger.info(f"Unknown command from {From}: {command}")
         message = "Unknown command. Try: door, status"
-        return PlainTextResponse(content=create_sms_response(message), status_code=200, media_type="application/xml")
-
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup."""
-    logger.info("Starting Pi Home Server...")
-    logger.info(f"Allowed phone numbers: {len(config.allowed_phone_numbers)}")
-    logger.info(f"Rate limit: {config.rate_limit_max_requests} requests per hour")
-
+    else:
+        logger.info(f"Processing '{command}' command from {From}")
+        message = await handler(From)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown."""
-    logger.info("Shutting down Pi Home Server...")
-    # Clean up door opener if needed
-    from door import _door_opener
-    if _door_opener:
-        _door_opener.stop()
+    return PlainTextResponse(content=create_sms_response(message), status_code=200, media_type="application/xml")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=config.host, port=config.port)
+    # uvloop/httptools (from uvicorn[standard]) are faster than asyncio/h11 on the Pi.
+    # Access logging is off since the app already logs each webhook.
+    uvicorn.run(
+        app,
+        host=config.host,
+        port=config.port,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+    )
@@ -95,4 +95,4 @@ echo "Press Ctrl+C to stop the server"
 echo ""
 
 # Start the server
-exec uvicorn main:app --host 0.0.0.0 --port "$PORT"
+exec uvicorn main:app --host 0.0.0.0 --port "$PORT" --loop uvloop --http httptools --no-access-log
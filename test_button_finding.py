@@ -3,7 +3,7 @@ Test script to verify button can be found without clicking it.
 """
 import logging
 from playwright.sync_api import sync_playwright, TimeoutError
-from auth import SessionManager
+from auth import SessionManager, is_login_url
 from config import config
 
 logging.basicConfig(level=logging.INFO)
@@ -16,11 +16,11 @@ def test_find_button():
     logger.info("Starting browser...")
     playwright = sync_playwright().start()
     browser = playwright.chromium.launch(headless=False)  # Show browser so you can see
-    context = browser.new_context()
 
-    # Load saved cookies if they exist
-    if session_manager.cookies_exist():
-        session_manager.load_cookies(context)
+    # Create the context from the saved session if it exists
+    storage_state = session_manager.load_storage_state()
+    context = browser.new_context(storage_state=storage_state)
+    if storage_state is not None:
         logger.info("Session loaded from cookies")
     else:
         logger.warning("No saved session found - you may need to run auth.py first")
@@ -35,7 +35,7 @@ def test_find_button():
 
         # Check if we got redirected to login (session expired)
         current_url = page.url
-        if "login" in current_url.lower() or "signin" in current_url.lower():
+        if is_login_url(current_url):
             logger.error("❌ Session expired - redirected to login")
             logger.info("Please run: python auth.py")
             return False